@@ -0,0 +1,121 @@
+# Measures how well spotify_get_all_results overlaps fetching pages with parsing them.
+# The Spotify API is simulated: each page of a synthetic library is served after a fixed network latency.
+# The end-to-end time is compared to the network time alone and to the parse time alone.
+# With full overlap it approaches the larger of the two, rather than their sum.
+# Run from the repository root: python benchmarks/bench_fetch_pipeline.py
+import argparse
+import os
+import sys
+import time
+
+benchmarks_dir = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.dirname(benchmarks_dir))
+
+import spotify_streamlit_app as app  # noqa: E402
+from synthetic_data import generate_library  # noqa: E402
+
+app.import_data_stack()
+pd = app.pd
+
+simulated_endpoint = "https://api.spotify.com/v1/me/tracks"
+
+
+# A response of the simulated Spotify API, with the parts of requests.Response the app uses.
+class SimulatedResponse:
+    def __init__(self, response_json):
+        self.response_json = response_json
+        self.status_code = 200
+        self.headers = {}
+
+    def raise_for_status(self):
+        pass
+
+    def json(self):
+        return self.response_json
+
+
+# Serves the pages of a list of items after a fixed latency, in place of the requests module.
+# Args:
+# items: the items to paginate
+# page_size: the number of items per page
+# latency_s: the simulated network latency of each page, in seconds
+class SimulatedSpotifyApi:
+    def __init__(self, items, page_size, latency_s):
+        self.items = items
+        self.page_size = page_size
+        self.latency_s = latency_s
+
+    def get(self, url, headers=None, params=None):
+        time.sleep(self.latency_s)
+
+        offset = int(url.split("offset=")[1]) if "offset=" in url else 0
+        next_offset = offset + self.page_size
+
+        return SimulatedResponse(
+            {
+                "items": self.items[offset:next_offset],
+                "total": len(self.items),
+                "limit": self.page_size,
+                "next": (
+                    f"{simulated_endpoint}?offset={next_offset}"
+                    if next_offset < len(self.items)
+                    else None
+                ),
+            }
+        )
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Benchmark overlapping of fetching and parsing pages."
+    )
+    parser.add_argument(
+        "--tracks", type=int, default=10_000, help="Number of liked tracks."
+    )
+    parser.add_argument(
+        "--page-size", type=int, default=50, help="Number of items per page."
+    )
+    parser.add_argument(
+        "--latency-ms",
+        type=float,
+        default=20,
+        help="Simulated network latency of each page, in milliseconds.",
+    )
+    args = parser.parse_args()
+
+    items = generate_library(args.tracks)["saved_tracks"]
+    pages = [
+        items[x : x + args.page_size] for x in range(0, len(items), args.page_size)
+    ]
+
+    # Time each stage on its own
+    network_s = len(pages) * args.latency_ms / 1000
+
+    start = time.perf_counter()
+    for page in pages:
+        pd.json_normalize(page, max_level=1)
+    parse_s = time.perf_counter() - start
+
+    # Time the pipeline end to end
+    app.requests = SimulatedSpotifyApi(items, args.page_size, args.latency_ms / 1000)
+    start = time.perf_counter()
+    app.spotify_get_all_results(
+        "token",
+        simulated_endpoint,
+        "application/json",
+        max_parse_level=1,
+        progress_callback=lambda curr_page_num, num_pages: None,
+    )
+    end_to_end_s = time.perf_counter() - start
+
+    print(f"{len(pages)} pages of {args.page_size} items")
+    print(f"network: {network_s:.2f} s")
+    print(f"parse: {parse_s:.2f} s")
+    print(
+        f"end to end: {end_to_end_s:.2f} s "
+        f"({end_to_end_s / max(network_s, parse_s):.2f}x max, {end_to_end_s / (network_s + parse_s):.2f}x sum)"
+    )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,127 @@
+# Checks that the DuckDB query backend returns the same results as the pandas one, then compares their speed.
+# Runs on synthetic libraries, by default of 10k and 100k liked tracks. Requires the optional duckdb package.
+# Exits with an error if any result differs between the backends.
+# Run from the repository root: python benchmarks/bench_query_backends.py
+import argparse
+import os
+import statistics
+import sys
+import time
+
+benchmarks_dir = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.dirname(benchmarks_dir))
+
+import spotify_streamlit_app as app  # noqa: E402
+from bench_transforms import build_inputs  # noqa: E402
+from synthetic_data import generate_library  # noqa: E402
+
+pd = app.pd
+
+default_sizes = [10_000, 100_000]
+
+# The derivations both backends implement.
+# Each is (method name, function building the arguments from the inputs, function putting results in a comparable form).
+# Arguments are rebuilt for every call, since some derivations modify their input in place.
+derivations = [
+    (
+        "compute_num_tracks_per_artist",
+        lambda x: (x["my_tracks"].copy(),),
+        # Artists with the same count may come back in any order
+        lambda df: df.sort_values(
+            [app.count_track_id_str, app.id_str], ascending=[False, True]
+        ),
+    ),
+    (
+        "compute_top_tracks_with_artists",
+        lambda x: (x["my_top_tracks"],),
+        lambda df: df,
+    ),
+    (
+        "merge_liked_and_followed_artists",
+        lambda x: (x["my_liked_artists_imgs"], x["my_followed_artists_imgs"]),
+        # pandas returns the merge indicator as a categorical
+        lambda df: df.astype({app.merge_str: str}),
+    ),
+]
+
+
+# Converts a result to object columns with None for every missing value, and a fresh index.
+# Args:
+# df: a result of either backend
+def normalize_result(df):
+    df = df.reset_index(drop=True).astype(object)
+    return df.where(df.notna(), None)
+
+
+# Raises an AssertionError if two results differ in anything but dtypes, index, and how missing values are represented.
+# Args:
+# pandas_result: the result of the pandas backend
+# duckdb_result: the result of the DuckDB backend
+def assert_same_result(pandas_result, duckdb_result):
+    pd.testing.assert_frame_equal(
+        normalize_result(pandas_result),
+        normalize_result(duckdb_result),
+        check_dtype=False,
+    )
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Check parity of the pandas and DuckDB query backends and compare their speed."
+    )
+    parser.add_argument(
+        "--sizes",
+        type=int,
+        nargs="+",
+        default=default_sizes,
+        help="Numbers of liked tracks to benchmark with.",
+    )
+    parser.add_argument(
+        "--repeats", type=int, default=3, help="Timed calls per derivation and size."
+    )
+    parser.add_argument(
+        "--database",
+        default=":memory:",
+        help="DuckDB database path, or :memory: for an in-memory database.",
+    )
+    args = parser.parse_args()
+
+    query_backends = {
+        app.pandas_str: app.PandasQueryBackend(),
+        app.duckdb_str: app.DuckDBQueryBackend(args.database),
+    }
+
+    for size in args.sizes:
+        inputs = build_inputs(generate_library(size))
+
+        for name, build_args, make_comparable in derivations:
+            results = {}
+            median_times_s = {}
+
+            for backend_name, query_backend in query_backends.items():
+                times_s = []
+                for _ in range(args.repeats):
+                    derivation_args = build_args(inputs)
+                    start = time.perf_counter()
+                    results[backend_name] = getattr(query_backend, name)(
+                        *derivation_args
+                    )
+                    times_s.append(time.perf_counter() - start)
+
+                median_times_s[backend_name] = statistics.median(times_s)
+
+            # Fail loudly if the backends disagree
+            assert_same_result(
+                make_comparable(results[app.pandas_str]),
+                make_comparable(results[app.duckdb_str]),
+            )
+
+            print(
+                f"{name} @ {size}: pandas {median_times_s[app.pandas_str] * 1000:.1f} ms, "
+                f"duckdb {median_times_s[app.duckdb_str] * 1000:.1f} ms "
+                f"({median_times_s[app.pandas_str] / median_times_s[app.duckdb_str]:.1f}x), results match"
+            )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,274 @@
+# Times and memory-profiles the app's pure data transforms on synthetic libraries of 1k, 10k and 100k liked tracks.
+# Results can be saved as a JSON baseline, and later runs compared against it to catch slowdowns.
+# Run from the repository root:
+#   python benchmarks/bench_transforms.py --save              (write benchmarks/baselines/transforms.json)
+#   python benchmarks/bench_transforms.py --compare           (fail if slower than the baseline)
+import argparse
+import json
+import os
+import platform
+import statistics
+import sys
+import time
+import tracemalloc
+
+benchmarks_dir = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.dirname(benchmarks_dir))
+
+import spotify_streamlit_app as app  # noqa: E402
+from synthetic_data import generate_library  # noqa: E402
+
+app.import_data_stack()
+pd = app.pd
+
+default_sizes = [1_000, 10_000, 100_000]
+default_baseline_path = os.path.join(benchmarks_dir, "baselines", "transforms.json")
+
+# A transform is slower than its baseline when its median time is more than this fraction above it
+default_threshold = 0.25
+
+
+# Converts a synthetic library to the DataFrames each transform receives in the app.
+# Returns a dictionary of DataFrames, keyed by name.
+# Args:
+# library: a dictionary as returned by generate_library
+def build_inputs(library):
+    # As returned by spotify_get_all_results for me/tracks
+    my_tracks = pd.json_normalize(library["saved_tracks"], max_level=1)
+
+    # As cleaned up by compute_num_tracks_per_artist, before unrolling artists
+    my_tracks_clean = my_tracks.copy()
+    my_tracks_clean.columns = my_tracks_clean.columns.str.replace(
+        f"{app.track_str}.", "", regex=False
+    )
+    my_tracks_clean = my_tracks_clean.rename(columns={app.id_str: app.track_id_str})
+
+    num_tracks_per_artist = app.compute_num_tracks_per_artist(my_tracks.copy())
+
+    # As prepared for compute_top_tracks_with_artists in run_app_contents. Top tracks never include local files.
+    my_top_tracks = pd.json_normalize(
+        [x["track"] for x in library["saved_tracks"] if x["track"]["id"] is not None],
+        max_level=0,
+    ).rename(columns={app.id_str: app.track_id_str, app.name_str: app.track_name_str})
+    my_top_tracks[app.track_rank_str] = range(1, len(my_top_tracks) + 1)
+
+    # As prepared for spotify_unroll_image_helper in run_app_contents
+    my_liked_artists = pd.merge(
+        pd.json_normalize(library["artists"], max_level=0)[
+            [app.id_str, app.images_str]
+        ],
+        num_tracks_per_artist,
+        on=app.id_str,
+        how="inner",
+    )
+    my_followed_artists = pd.json_normalize(library["followed_artists"], max_level=0)
+
+    return {
+        "my_tracks": my_tracks,
+        "my_tracks_clean": my_tracks_clean,
+        "my_top_tracks": my_top_tracks,
+        "my_liked_artists": my_liked_artists,
+        "my_liked_artists_imgs": app.spotify_unroll_image_helper(my_liked_artists),
+        "my_followed_artists_imgs": app.spotify_unroll_image_helper(
+            my_followed_artists
+        ),
+    }
+
+
+# Calls assign_id_and_parse on every row, as convert_json_col_to_dataframe_with_key does, without the union.
+# Args:
+# rows: list of pandas Series, one per liked track
+def assign_id_and_parse_all_rows(rows):
+    for row in rows:
+        app.assign_id_and_parse(row, app.track_id_str, app.artists_str)
+
+
+# The transforms to benchmark.
+# Each is (name, function building the untimed arguments from the inputs, function timed).
+# Arguments are rebuilt for every call, since some transforms modify their input in place.
+transforms = [
+    (
+        "assign_id_and_parse",
+        lambda x: ([row for _, row in x["my_tracks_clean"].iterrows()],),
+        assign_id_and_parse_all_rows,
+    ),
+    (
+        "convert_json_col_to_dataframe_with_key",
+        lambda x: (x["my_tracks_clean"], app.track_id_str, app.artists_str),
+        app.convert_json_col_to_dataframe_with_key,
+    ),
+    (
+        "spotify_unroll_image_helper",
+        lambda x: (x["my_liked_artists"].copy(),),
+        app.spotify_unroll_image_helper,
+    ),
+    (
+        "compute_num_tracks_per_artist",
+        lambda x: (x["my_tracks"].copy(),),
+        app.compute_num_tracks_per_artist,
+    ),
+    (
+        "compute_top_tracks_with_artists",
+        lambda x: (x["my_top_tracks"],),
+        app.compute_top_tracks_with_artists,
+    ),
+    (
+        "merge_liked_and_followed_artists",
+        lambda x: (x["my_liked_artists_imgs"], x["my_followed_artists_imgs"]),
+        app.merge_liked_and_followed_artists,
+    ),
+]
+
+
+# Times a transform and measures the peak memory it allocates.
+# Returns a dictionary of the median and minimum seconds over the repeats, and the peak memory in MB.
+# Memory is measured in a separate, untimed call, since tracing allocations slows the transform down.
+# Args:
+# build_args: function returning the arguments of one call
+# transform: the function to benchmark
+# repeats: the number of timed calls
+def benchmark_transform(build_args, transform, repeats):
+    times_s = []
+    for _ in range(repeats):
+        args = build_args()
+        start = time.perf_counter()
+        transform(*args)
+        times_s.append(time.perf_counter() - start)
+
+    args = build_args()
+    tracemalloc.start()
+    transform(*args)
+    peak_memory_bytes = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+
+    return {
+        "median_s": statistics.median(times_s),
+        "min_s": min(times_s),
+        "peak_memory_mb": round(peak_memory_bytes / 2**20, 2),
+    }
+
+
+# Runs every transform at every size.
+# Returns a dictionary of results: transform name -> size (as a string, for JSON) -> measurements.
+# Args:
+# sizes: the numbers of liked tracks to benchmark with
+# repeats: the number of timed calls per transform and size
+def run_benchmarks(sizes, repeats):
+    results = {name: {} for name, _, _ in transforms}
+
+    for size in sizes:
+        inputs = build_inputs(generate_library(size))
+
+        for name, build_args, transform in transforms:
+            results[name][str(size)] = benchmark_transform(
+                lambda: build_args(inputs), transform, repeats
+            )
+
+            measurements = results[name][str(size)]
+            print(
+                f"{name} @ {size}: median {measurements['median_s'] * 1000:.1f} ms, "
+                f"peak memory {measurements['peak_memory_mb']} MB"
+            )
+
+    return results
+
+
+# Compares results against a baseline.
+# Returns a list of descriptions of the transforms and sizes slower than the baseline by more than the threshold.
+# Args:
+# results: results as returned by run_benchmarks
+# baseline: results loaded from a baseline file
+# threshold: the allowed fraction of slowdown
+def compare_to_baseline(results, baseline, threshold):
+    regressions = []
+
+    for name, results_by_size in results.items():
+        for size, measurements in results_by_size.items():
+            baseline_measurements = baseline.get(name, {}).get(size)
+            if baseline_measurements is None:
+                print(f"{name} @ {size}: no baseline")
+                continue
+
+            ratio = measurements["median_s"] / baseline_measurements["median_s"]
+            memory_change_mb = (
+                measurements["peak_memory_mb"] - baseline_measurements["peak_memory_mb"]
+            )
+            print(
+                f"{name} @ {size}: {ratio:.2f}x baseline time, {memory_change_mb:+.2f} MB peak memory"
+            )
+
+            if ratio > 1 + threshold:
+                regressions.append(f"{name} @ {size} ({ratio:.2f}x)")
+
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Benchmark the app's data transforms on synthetic libraries."
+    )
+    parser.add_argument(
+        "--sizes",
+        type=int,
+        nargs="+",
+        default=default_sizes,
+        help="Numbers of liked tracks to benchmark with.",
+    )
+    parser.add_argument(
+        "--repeats", type=int, default=3, help="Timed calls per transform and size."
+    )
+    parser.add_argument(
+        "--baseline", default=default_baseline_path, help="Path of the baseline file."
+    )
+    parser.add_argument(
+        "--save", action="store_true", help="Save the results as the baseline."
+    )
+    parser.add_argument(
+        "--compare",
+        action="store_true",
+        help="Compare the results to the baseline, failing on slowdowns.",
+    )
+    parser.add_argument(
+        "--threshold",
+        type=float,
+        default=default_threshold,
+        help="Allowed slowdown as a fraction of the baseline time, e.g. 0.25 for 25%%.",
+    )
+    args = parser.parse_args()
+
+    results = run_benchmarks(args.sizes, args.repeats)
+
+    if args.save:
+        os.makedirs(os.path.dirname(args.baseline), exist_ok=True)
+        with open(args.baseline, "w") as f:
+            json.dump(
+                {
+                    "environment": {
+                        "python": platform.python_version(),
+                        "pandas": pd.__version__,
+                        "numpy": app.np.__version__,
+                        "machine": platform.machine(),
+                        "processor": platform.processor(),
+                    },
+                    "results": results,
+                },
+                f,
+                indent=2,
+            )
+            f.write("\n")
+
+    if args.compare:
+        with open(args.baseline) as f:
+            baseline = json.load(f)["results"]
+
+        regressions = compare_to_baseline(results, baseline, args.threshold)
+        if regressions:
+            print(
+                f"Slower than the baseline by more than {args.threshold:.0%}: "
+                + ", ".join(regressions)
+            )
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,77 @@
+# Measures the cold import cost of the app, to track startup latency.
+# Each measurement runs in a fresh Python process so nothing is cached in sys.modules.
+# Run from the repository root: python benchmarks/import_time.py
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+
+repo_root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# Names of the measurements taken in each fresh process.
+# "login_path" is what the Welcome screen pays for. "data_stack" is what is loaded lazily after sign in.
+measurement_names = ["login_path", "data_stack"]
+
+timing_code = """
+import time
+start = time.perf_counter()
+import spotify_streamlit_app
+login_path_s = time.perf_counter() - start
+start = time.perf_counter()
+spotify_streamlit_app.import_requests()
+spotify_streamlit_app.import_data_stack()
+data_stack_s = time.perf_counter() - start
+print(login_path_s, data_stack_s)
+"""
+
+
+# Times one cold start in a fresh process.
+# Returns a dictionary of seconds taken, keyed by the names in measurement_names.
+def time_one_cold_start():
+    completed = subprocess.run(
+        [sys.executable, "-c", timing_code],
+        cwd=repo_root,
+        capture_output=True,
+        text=True,
+        check=True,
+    )
+
+    return dict(zip(measurement_names, (float(x) for x in completed.stdout.split())))
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Time cold imports of the Streamlit app."
+    )
+    parser.add_argument(
+        "--runs", type=int, default=10, help="Number of cold starts to time."
+    )
+    parser.add_argument(
+        "--json", action="store_true", help="Print the results as JSON."
+    )
+    args = parser.parse_args()
+
+    runs = [time_one_cold_start() for _ in range(args.runs)]
+
+    # Report the median and minimum in milliseconds for each measurement
+    results = {
+        name: {
+            "median_ms": round(statistics.median(x[name] for x in runs) * 1000, 1),
+            "min_ms": round(min(x[name] for x in runs) * 1000, 1),
+        }
+        for name in measurement_names
+    }
+
+    if args.json:
+        print(json.dumps(results, indent=2))
+    else:
+        for name, result in results.items():
+            print(
+                f"{name}: median {result['median_ms']} ms, min {result['min_ms']} ms ({args.runs} runs)"
+            )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,190 @@
+# Deterministic generator of synthetic, Spotify-shaped JSON for benchmarks.
+# The same seed and size always produce the same data, so benchmark runs are comparable.
+import datetime
+import itertools
+import random
+
+# Share of tracks with 1, 2, 3 and 4 artists. Most tracks have a single artist.
+artists_per_track_weights = {1: 0.72, 2: 0.2, 3: 0.06, 4: 0.02}
+
+# Share of artists with 0, 1 and 3 images. Most artists have the standard 3 sizes.
+images_per_artist_weights = {0: 0.05, 1: 0.1, 3: 0.85}
+
+# Image sizes the API returns for artists and albums
+artist_image_heights = [640, 320, 160]
+album_image_heights = [640, 300, 64]
+
+# Liked tracks per artist follow a Zipf-like distribution: a few artists have most of the liked tracks
+artist_popularity_exponent = 1.1
+
+# Ratio of liked tracks to distinct artists, and the share of artists the user follows
+tracks_per_artist = 4
+followed_artist_share = 0.1
+
+# Share of followed artists with no liked tracks
+unliked_followed_artist_share = 0.05
+
+# Share of liked tracks that are local files, which have no track, album or artist ids.
+# Their artists are drawn from a small pool of names, so several local files share an artist.
+local_track_share = 0.01
+num_local_artist_names = 10
+
+first_added_at = datetime.datetime(2015, 1, 1, tzinfo=datetime.timezone.utc)
+
+
+# Generates a list of image objects, one per height.
+# Args:
+# rng: the random.Random instance to draw from
+# heights: the image heights to generate
+def generate_images(rng, heights):
+    return [
+        {
+            "url": f"https://i.scdn.co/image/{rng.getrandbits(64):016x}",
+            "height": x,
+            "width": x,
+        }
+        for x in heights
+    ]
+
+
+# Generates artist objects, as returned by the artists endpoint.
+# Args:
+# rng: the random.Random instance to draw from
+# num_artists: the number of artists to generate
+# id_prefix: prefix of the artist ids, so different pools don't collide
+def generate_artists(rng, num_artists, id_prefix="artist"):
+    artists = []
+    for i in range(num_artists):
+        num_images = rng.choices(
+            list(images_per_artist_weights), list(images_per_artist_weights.values())
+        )[0]
+
+        artists.append(
+            {
+                "id": f"{id_prefix}{i:07d}",
+                "name": f"Artist {id_prefix} {i}",
+                "type": "artist",
+                "popularity": rng.randint(0, 100),
+                "genres": rng.sample(["pop", "rock", "jazz", "indie", "hip hop"], 2),
+                "images": generate_images(
+                    rng,
+                    (
+                        artist_image_heights
+                        if num_images == 3
+                        else rng.sample(artist_image_heights, num_images)
+                    ),
+                ),
+            }
+        )
+
+    return artists
+
+
+# Generates a local file track object, as nested in a me/tracks item.
+# Args:
+# rng: the random.Random instance to draw from
+# i: the index of the liked track
+def generate_local_track(rng, i):
+    return {
+        "id": None,
+        "name": f"Local Track {i}",
+        "type": "track",
+        "is_local": True,
+        "popularity": 0,
+        "duration_ms": rng.randint(90_000, 420_000),
+        "artists": [
+            {
+                "id": None,
+                "name": f"Local Artist {rng.randrange(num_local_artist_names)}",
+                "type": "artist",
+            }
+        ],
+        "album": {"id": None, "name": f"Local Album {i}", "images": []},
+    }
+
+
+# Generates Spotify-shaped data for a library of liked tracks.
+# Returns a dictionary of:
+# "saved_tracks": items of the me/tracks endpoint, including a share of local files
+# "artists": the full artist objects of the artist pool the liked tracks are drawn from, as returned by the artists endpoint
+# "followed_artists": items of the me/following endpoint
+# Args:
+# num_tracks: the number of liked tracks
+# seed: the random seed
+def generate_library(num_tracks, seed=0):
+    rng = random.Random(seed)
+
+    num_artists = max(num_tracks // tracks_per_artist, 1)
+    artists = generate_artists(rng, num_artists)
+
+    # Simplified artist objects, as nested in track objects
+    simplified_artists = [
+        {"id": x["id"], "name": x["name"], "type": "artist"} for x in artists
+    ]
+    artist_cum_weights = list(
+        itertools.accumulate(
+            1 / (rank**artist_popularity_exponent) for rank in range(1, num_artists + 1)
+        )
+    )
+
+    saved_tracks = []
+    for i in range(num_tracks):
+        added_at = first_added_at + datetime.timedelta(
+            seconds=rng.randint(0, 10 * 365 * 24 * 3600)
+        )
+
+        if rng.random() < local_track_share:
+            saved_tracks.append(
+                {
+                    "added_at": added_at.strftime("%Y-%m-%dT%H:%M:%SZ"),
+                    "track": generate_local_track(rng, i),
+                }
+            )
+            continue
+
+        num_track_artists = min(
+            rng.choices(
+                list(artists_per_track_weights),
+                list(artists_per_track_weights.values()),
+            )[0],
+            num_artists,
+        )
+
+        # Draw distinct artists, favouring popular ones
+        track_artists = {}
+        while len(track_artists) < num_track_artists:
+            artist = rng.choices(simplified_artists, cum_weights=artist_cum_weights)[0]
+            track_artists[artist["id"]] = artist
+
+        saved_tracks.append(
+            {
+                "added_at": added_at.strftime("%Y-%m-%dT%H:%M:%SZ"),
+                "track": {
+                    "id": f"track{i:08d}",
+                    "name": f"Track {i}",
+                    "type": "track",
+                    "popularity": rng.randint(0, 100),
+                    "duration_ms": rng.randint(90_000, 420_000),
+                    "artists": list(track_artists.values()),
+                    "album": {
+                        "id": f"album{i:08d}",
+                        "name": f"Album {i}",
+                        "images": generate_images(rng, album_image_heights),
+                    },
+                },
+            }
+        )
+
+    # Followed artists are mostly liked artists, plus a few with no liked tracks
+    num_followed_artists = max(int(num_artists * followed_artist_share), 1)
+    followed_artists = rng.sample(artists, num_followed_artists) + generate_artists(
+        rng,
+        max(int(num_followed_artists * unliked_followed_artist_share), 1),
+        id_prefix="unliked",
+    )
+
+    return {
+        "saved_tracks": saved_tracks,
+        "artists": artists,
+        "followed_artists": followed_artists,
+    }
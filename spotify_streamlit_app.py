@@ -1,15 +1,29 @@
 import json
-import requests
 import base64
+import collections
+import concurrent.futures
+import functools
+import os
+import urllib.parse
 
-import numpy as np
-import pandas as pd
-
+import threading
 import time
 import streamlit as st
 
 import sys
 
+# The data stack (numpy, pandas, pyarrow, requests) is slow to import and unused by the Welcome screen.
+# These are bound by import_requests() and import_data_stack() once the user signs in.
+requests = None
+np = None
+pd = None
+pa = None
+pc = None
+pq = None
+
+# Background thread importing the data stack, started as soon as the OAuth 2.0 code arrives.
+data_stack_import_thread = None
+
 # import plotly.express as px
 
 # pd.set_option("display.max_columns", None)
@@ -48,10 +62,126 @@ images_str = "images"
 
 height_str = "height"
 
+access_token_str = "access_token"
+fetch_job_str = "fetch_job"
+
+term_str = "term"
+underscore_term_str = f"_{term_str}"
+term_timeframes_friendly = ["short", "medium", "long"]
+term_timeframes = [f"{x}{underscore_term_str}" for x in term_timeframes_friendly]
+
+# Stage names of the background fetch job. Each is the key of its result.
+num_tracks_per_artist_str = "num_tracks_per_artist"
+top_tracks_stage_strs = [f"top_tracks_{x}" for x in term_timeframes]
+liked_artists_str = "liked_artists"
+followed_artists_str = "followed_artists"
+
+# How often, in seconds, the script thread checks on the background fetch job
+fetch_job_poll_interval_s = 0.25
+
+playlist_id_str = "playlist_id"
+snapshot_id_str = "snapshot_id"
+owner_id_str = "owner.id"
+is_own_playlist_str = "is_own_playlist"
+count_playlist_track_id_str = f"count_playlist_{track_id_str}"
+num_playlist_tracks_str = "Tracks in My Playlists"
+
+# More stage names of the background fetch job. liked_track_ids is stored by the num_tracks_per_artist stage.
+liked_track_ids_str = "liked_track_ids"
+user_profile_str = "user_profile"
+playlist_tracks_str = "playlist_tracks"
+
+# Playlist items are fetched concurrently, bounded to stay clear of Spotify's rate limits.
+max_concurrent_playlist_fetches = 8
+
+# Playlist items kept in the snapshot cache, across all users. The least recently used playlists are evicted past this.
+max_playlist_snapshot_cache_items = 200_000
+
+merge_str = "_merge"
+
+# Query backends, chosen with the query_backend secret. DuckDB is optional and only imported when chosen.
+pandas_str = "pandas"
+duckdb_str = "duckdb"
+
+# Only request the playlist item fields used, plus those spotify_get_all_results needs to paginate.
+playlist_items_fields = "items(track(id,artists(id,name))),next,total,limit"
+
+played_at_str = "played_at"
+artist_id_str = f"{artist_str.lower()}_{id_str}"
+play_count_str = "play_count"
+num_plays_str = "Recent Plays"
+
+# More stage names of the background fetch job
+artist_play_counts_str = "artist_play_counts"
+
+# Each user's play log lives in their own directory under this one, next to this file.
+# A log is a series of Parquet part files, one per sync, plus a file of running play counts per artist.
+play_log_dir = os.path.join(os.path.dirname(os.path.abspath(__file__)), ".play_history")
+play_log_part_prefix = "plays-"
+artist_play_counts_file_name = "artist_play_counts.parquet"
+
+# Parquet metadata key of the after cursor (Unix ms) the running play counts are up to date with
+play_log_cursor_key = b"after"
+
+# When a play log has more part files than this, they are compacted into one
+max_play_log_parts = 64
+
+# The recently played endpoint returns at most this many plays per call
+max_recently_played_per_call = 50
+
+# Labels of the playlist track overlap counts
+unique_playlist_tracks_str = "Unique Tracks in My Playlists"
+duplicated_playlist_tracks_str = "Tracks in 2+ Playlists"
+liked_tracks_in_playlists_str = "Liked Tracks in a Playlist"
+liked_tracks_not_in_playlists_str = "Liked Tracks in No Playlist"
+
+# Tables with more rows than this are sent to the frontend one page at a time.
+max_rows_per_table_page = 1000
+
+# When rate limited, an API call is retried at most this many times, waiting at most this many seconds in total
+max_rate_limit_retries = 5
+max_rate_limit_wait_s = 60
+
+# Fetched pages of a paginated API call held in memory while waiting to be parsed. Fetching pauses when this many are waiting.
+max_pages_in_flight = 8
+
 spotify_accounts_endpoint = "https://accounts.spotify.com/"
 spotify_api_endpoint = "https://api.spotify.com/v1/"
 
 
+# Imports requests as a module global. Only needed once the user is signing in.
+def import_requests():
+    global requests
+    import requests
+
+
+# Imports the libraries used to process Spotify data as module globals.
+# Cheap when already imported, since Python caches imported modules.
+def import_data_stack():
+    global np, pd, pa, pc, pq
+    import numpy as np
+    import pandas as pd
+    import pyarrow as pa
+    import pyarrow.compute as pc
+    import pyarrow.parquet as pq
+
+
+# Starts importing the data stack on a background thread, so the import overlaps with the OAuth 2.0 token exchange.
+def start_data_stack_import():
+    global data_stack_import_thread
+    data_stack_import_thread = threading.Thread(target=import_data_stack, daemon=True)
+    data_stack_import_thread.start()
+
+
+# Blocks until the data stack is imported, importing it on the current thread if no background import was started.
+def wait_for_data_stack():
+    if data_stack_import_thread is not None:
+        data_stack_import_thread.join()
+
+    # Binds the globals in this thread too (e.g. on a rerun, where nothing was started)
+    import_data_stack()
+
+
 # Helper function
 # A field of JSON from a row of data is converted to its own dataframe
 # In addtion, the unique id columns from its source are appended on as the first columns.
@@ -101,6 +231,8 @@ def convert_json_col_to_dataframe_with_key(df, id_col_names, json_col_name):
 # base_obj: a string to pass if the returned JSON is wrapped in a tag. Used to filter out the tag for parsing efficiency.
 # balloons: a Boolean to control if Streamlit balloons should show after API call completion.
 # paginated: a Boolean to indicate if pagination is part of the API call.
+# progress_callback: a function called with (pages loaded, total pages) after each page of a paginated call.
+#   Use it when calling from outside the Streamlit script thread. If None, a Streamlit progress bar is shown instead.
 def spotify_get_all_results(
     access_token,
     endpoint,
@@ -110,6 +242,7 @@ def spotify_get_all_results(
     base_obj=None,
     balloons=False,
     paginated=True,
+    progress_callback=None,
 ):
     # Header setup
     api_call_headers = {
@@ -124,58 +257,108 @@ def spotify_get_all_results(
     first_call = True
     retVal_list = list()
 
-    # Loop through the API-provided next endpoints until no more exist. Union the results.
-    while next_api_url is not None:
-        # HTTP GET
-        # raise_for_status() will stop execution on this fatal error.
-        api_request = requests.get(
-            next_api_url, headers=api_call_headers, params=query if first_call else {}
-        )
-        api_request.raise_for_status()
-
-        # Get the repsonse in JSON
-        api_request_json = api_request.json()
-
-        # Filter out the base_obj if it exists
-        if base_obj is not None:
-            # Too simple for JMESPath...
-            # TODO convert to JMESPath if more complex use cases arise
-            api_request_json = api_request_json[base_obj]
-
-        # If paginated and the first call, determine how many pages of data the API will have to retrieve.
-        # Use this calculation to create a progress bar to display.
-        if paginated and first_call:
-            num_pages = int(
-                np.ceil(api_request_json["total"] / api_request_json["limit"])
-            )
+    # Pages of paginated calls are parsed by a worker thread while the next page is fetched, so network and parsing overlap.
+    # A thread rather than processes, since pickling pages to and from processes costs about as much as parsing them.
+    # The semaphore bounds how many fetched pages wait to be parsed, so memory stays bounded if parsing falls behind.
+    parse_executor = None
+    pages_in_flight = threading.BoundedSemaphore(max_pages_in_flight)
+
+    try:
+        # Loop through the API-provided next endpoints until no more exist. Union the results.
+        while next_api_url is not None:
+            # HTTP GET
+            # When rate limited (e.g. by concurrent playlist fetches), wait as long as Spotify asks and retry.
+            # Retries are bounded in number and total wait, so a long rate limit fails instead of hanging.
+            # raise_for_status() will stop execution on any other error, or once retries run out.
+            num_rate_limit_retries = 0
+            rate_limit_wait_s = 0
+            while True:
+                api_request = requests.get(
+                    next_api_url,
+                    headers=api_call_headers,
+                    params=query if first_call else {},
+                )
 
-            first_call = False
+                if api_request.status_code != 429:
+                    break
 
-            progress_bar = st.progress(curr_page_num, text="Loading...")
+                retry_after_s = int(api_request.headers.get("Retry-After", 1))
+                if (
+                    num_rate_limit_retries >= max_rate_limit_retries
+                    or rate_limit_wait_s + retry_after_s > max_rate_limit_wait_s
+                ):
+                    break
 
-        # Get the next endpoint to call, and convert the current JSON response to a DataFrame.
-        # End the loop if paginated by setting "next" to None.
-        next_api_url = api_request_json["next"] if paginated else None
+                time.sleep(retry_after_s)
+                num_rate_limit_retries += 1
+                rate_limit_wait_s += retry_after_s
 
-        retVal_list.append(
-            pd.json_normalize(
-                api_request_json["items"] if paginated else api_request_json,
-                max_level=max_parse_level,
-            )
-        )
+            api_request.raise_for_status()
 
-        # Update the progress bar for paginated queries
-        if paginated:
-            curr_page_num += 1
+            # Get the repsonse in JSON
+            api_request_json = api_request.json()
 
-            # Update the progress bar
-            progress_bar.progress(
-                curr_page_num / num_pages,
-                text=f"Loaded Page: {curr_page_num} of {num_pages}",
-            )
+            # Filter out the base_obj if it exists
+            if base_obj is not None:
+                # Too simple for JMESPath...
+                # TODO convert to JMESPath if more complex use cases arise
+                api_request_json = api_request_json[base_obj]
+
+            # If paginated and the first call, determine how many pages of data the API will have to retrieve.
+            # Use this calculation to create a progress bar to display.
+            if paginated and first_call:
+                num_pages = int(
+                    np.ceil(api_request_json["total"] / api_request_json["limit"])
+                )
+
+                first_call = False
+
+                parse_executor = concurrent.futures.ThreadPoolExecutor(max_workers=1)
+
+                if progress_callback is None:
+                    progress_bar = st.progress(curr_page_num, text="Loading...")
+
+            # Get the next endpoint to call, and convert the current JSON response to a DataFrame.
+            # End the loop if paginated by setting "next" to None.
+            next_api_url = api_request_json["next"] if paginated else None
+
+            if paginated:
+                # Wait for a free slot, then hand the page over to be parsed while the next one is fetched
+                pages_in_flight.acquire()
+                parsed_page = parse_executor.submit(
+                    pd.json_normalize,
+                    api_request_json["items"],
+                    max_level=max_parse_level,
+                )
+                parsed_page.add_done_callback(lambda _: pages_in_flight.release())
+                retVal_list.append(parsed_page)
+            else:
+                retVal_list.append(
+                    pd.json_normalize(api_request_json, max_level=max_parse_level)
+                )
+
+            # Update the progress bar for paginated queries
+            if paginated:
+                curr_page_num += 1
+
+                # Update the progress bar
+                if progress_callback is None:
+                    progress_bar.progress(
+                        curr_page_num / num_pages,
+                        text=f"Loaded Page: {curr_page_num} of {num_pages}",
+                    )
+                else:
+                    progress_callback(curr_page_num, num_pages)
+
+        # Collect the parsed pages, in page order
+        if paginated:
+            retVal_list = [x.result() for x in retVal_list]
+    finally:
+        if parse_executor is not None:
+            parse_executor.shutdown(cancel_futures=True)
 
     # Clear the progress bar for paginated queries
-    if paginated:
+    if paginated and progress_callback is None:
         # When processing is complete, stop showing the progress bar
         progress_bar.empty()
 
@@ -187,6 +370,180 @@ def spotify_get_all_results(
     return pd.concat(retVal_list).reset_index(drop=True)
 
 
+# Converts the liked tracks from the me/tracks endpoint to the number of liked tracks per artist.
+# Returns a DataFrame with one row per artist, sorted by liked track count descending, and the last date one was liked.
+# Args:
+# my_tracks: the DataFrame of liked tracks, as returned by spotify_get_all_results with max_parse_level=1.
+def compute_num_tracks_per_artist(my_tracks):
+    # Header and column cleanup
+    my_tracks.columns = my_tracks.columns.str.replace(f"{track_str}.", "", regex=False)
+    my_tracks = my_tracks.rename(columns={id_str: track_id_str})
+
+    my_tracks[added_at_str] = pd.to_datetime(my_tracks[added_at_str])
+
+    # Unroll artist data
+    track_artists_df = convert_json_col_to_dataframe_with_key(
+        my_tracks, track_id_str, artists_str
+    )
+
+    # Pull in the added_at field for each track
+    track_artists_df_with_added_at = pd.merge(
+        track_artists_df, my_tracks[[track_id_str, added_at_str]], on=track_id_str
+    )
+
+    # Create field for added_at formatted as YYYY-MM-DD
+    track_artists_df_with_added_at[added_at_ymd_str] = track_artists_df_with_added_at[
+        added_at_str
+    ].dt.date
+
+    # Use the DataFrame linking tracks to artists to get the number of tracks liked per artist.
+    return (
+        track_artists_df_with_added_at.groupby([id_str, name_str])
+        .agg({track_id_str: "count", added_at_ymd_str: "max"})
+        .sort_values(track_id_str, ascending=False)
+        .reset_index()
+        .rename(
+            columns={
+                track_id_str: count_track_id_str,
+                added_at_ymd_str: max_added_at_ymd_str,
+            }
+        )
+    )
+
+
+# Computes how the user's liked tracks and playlist tracks overlap.
+# Track ids are factorized into a single hash index, so all counts come from one vectorized pass over integer codes.
+# Returns a dictionary of counts keyed by their display labels.
+# Args:
+# playlist_tracks: DataFrame with playlist_id and track_id columns, one row per playlist item.
+# liked_track_ids: Series of the ids of the user's liked tracks.
+def compute_playlist_track_overlap(playlist_tracks, liked_track_ids):
+    # Each track id gets one integer code, whether it is in a playlist, liked, or both
+    track_id_codes, unique_track_ids = pd.factorize(
+        pd.concat([playlist_tracks[track_id_str], liked_track_ids], ignore_index=True)
+    )
+    num_unique_track_ids = len(unique_track_ids)
+    playlist_track_codes = track_id_codes[: len(playlist_tracks)]
+    liked_track_codes = track_id_codes[len(playlist_tracks) :]
+
+    # Combine playlist and track codes into one key, so a track repeated within a playlist only counts once for it
+    playlist_codes = pd.factorize(playlist_tracks[playlist_id_str])[0]
+    playlist_track_keys = np.unique(
+        playlist_codes.astype(np.int64) * num_unique_track_ids + playlist_track_codes
+    )
+
+    # Number of distinct playlists each track is in
+    num_playlists_per_track = np.bincount(
+        playlist_track_keys % num_unique_track_ids, minlength=num_unique_track_ids
+    )
+    is_in_playlist = num_playlists_per_track > 0
+
+    is_liked = np.zeros(num_unique_track_ids, dtype=bool)
+    is_liked[liked_track_codes] = True
+
+    return {
+        unique_playlist_tracks_str: int(is_in_playlist.sum()),
+        duplicated_playlist_tracks_str: int((num_playlists_per_track > 1).sum()),
+        liked_tracks_in_playlists_str: int((is_liked & is_in_playlist).sum()),
+        liked_tracks_not_in_playlists_str: int((is_liked & ~is_in_playlist).sum()),
+    }
+
+
+# Counts how many playlist items are by each liked artist.
+# Returns the rows of num_tracks_per_artist for artists in the playlists, with a count_playlist_track_id column, sorted by it descending.
+# Args:
+# playlist_tracks: DataFrame with an artists column of JSON, one row per playlist item.
+# num_tracks_per_artist: the DataFrame returned by compute_num_tracks_per_artist.
+def compute_liked_artists_in_playlists(playlist_tracks, num_tracks_per_artist):
+    # No playlist items means no artists to count, and no artists column to parse
+    if playlist_tracks.empty:
+        return num_tracks_per_artist.iloc[:0].assign(**{count_playlist_track_id_str: 0})
+
+    # One artist id per row, for tracks with multiple artists
+    playlist_artist_ids = playlist_tracks[artists_str].explode().str.get(id_str)
+
+    num_playlist_tracks_per_artist = (
+        playlist_artist_ids.value_counts()
+        .rename_axis(id_str)
+        .reset_index(name=count_playlist_track_id_str)
+    )
+
+    return pd.merge(
+        num_tracks_per_artist,
+        num_playlist_tracks_per_artist,
+        on=id_str,
+        how="inner",
+    ).sort_values(count_playlist_track_id_str, ascending=False)
+
+
+# Links top tracks to their artists.
+# Tracks can have more than 1 artist, so flatten the artist_name column so each is seperated by a "; ".
+# We do so to have 1 row per track.
+# Returns a DataFrame of track rank, id, artist names and name, sorted by rank.
+# Args:
+# my_top_tracks: DataFrame of top tracks with track_id, track_rank, track_name and artists columns.
+def compute_top_tracks_with_artists(my_top_tracks):
+    return (
+        pd.merge(
+            my_top_tracks[[track_id_str, track_rank_str, track_name_str]],
+            convert_json_col_to_dataframe_with_key(
+                my_top_tracks, track_id_str, artists_str
+            ),
+            on=track_id_str,
+        )
+        .rename(columns={name_str: artist_name_str})
+        .groupby([track_id_str, track_rank_str, track_name_str])
+        .agg({artist_name_str: "; ".join})
+        .sort_values(track_rank_str, ascending=True)
+        .reset_index()[[track_rank_str, track_id_str, artist_name_str, track_name_str]]
+    )
+
+
+# Performs an outer join between liked and followed artists.
+# Followed artists with no liked tracks keep their name and image URL from the followed artist data.
+# Returns the liked artist columns plus a _merge column: "left_only" if only liked, "right_only" if only followed, or "both".
+# Args:
+# my_liked_artists_imgs: DataFrame of liked artists, as returned by spotify_unroll_image_helper.
+# my_followed_artists_imgs: DataFrame of followed artists, as returned by spotify_unroll_image_helper.
+def merge_liked_and_followed_artists(my_liked_artists_imgs, my_followed_artists_imgs):
+    my_left = my_liked_artists_imgs
+    my_right = my_followed_artists_imgs
+
+    my_left_cols = [x for x in my_left.columns]
+
+    underscore_y_str = "_y"
+    url_y_str = url_str + underscore_y_str
+    name_y_str = name_str + underscore_y_str
+
+    my_followed_and_liked_artists_df = pd.merge(
+        my_left,
+        my_right,
+        on=id_str,
+        how="outer",
+        suffixes=("", underscore_y_str),
+        indicator=True,
+    )[my_left_cols + [name_y_str, url_y_str, merge_str]]
+
+    # Look for rows where an artist is followed with no liked songs.
+    # "name" would be NA but "name_y" would not be.
+    unfollow_artist_rec_rows_to_retrieve = my_followed_and_liked_artists_df[
+        name_str
+    ].isna()
+
+    # Get the name and URL for those rows
+    unfollow_artist_rec_replace_vals = my_followed_and_liked_artists_df.loc[
+        unfollow_artist_rec_rows_to_retrieve, [name_y_str, url_y_str]
+    ]
+
+    # Replace "name" and "url" columns with the retrieved values
+    my_followed_and_liked_artists_df.loc[
+        unfollow_artist_rec_rows_to_retrieve, [name_str, url_str]
+    ] = unfollow_artist_rec_replace_vals.values
+
+    # Remove extraneous columns
+    return my_followed_and_liked_artists_df[my_left_cols + [merge_str]]
+
+
 # Helper function to unroll image data held in JSON.
 # Looks for an "images" column and creates a DataFrame linking that unrolled JSON with the "id" column value for that row.
 # Returns arg `df` with a `url` column added with an image link from the above described processing.
@@ -345,6 +702,800 @@ def generate_style_and_div_blocks(
     )
 
 
+# Streamlit wrapper to display an Arrow table, sending at most one page of rows to the frontend per render.
+# Slices of an Arrow table are zero-copy, so only the visible page is serialized.
+# Args:
+# arrow_table: the pyarrow Table to display
+# page_size: the maximum number of rows to display at once
+# widget_key: a unique Streamlit key for the page selector
+# st_dataframe_kwargs: passed through to st.dataframe
+def st_paginated_arrow_dataframe(
+    arrow_table, page_size, widget_key, **st_dataframe_kwargs
+):
+    num_rows = arrow_table.num_rows
+    num_pages = max(int(np.ceil(num_rows / page_size)), 1)
+    first_row = 0
+
+    # Only show the page selector when the table does not fit on one page
+    if num_pages > 1:
+        page_num = st.number_input(
+            f"Page (of {num_pages})",
+            min_value=1,
+            max_value=num_pages,
+            value=1,
+            step=1,
+            key=widget_key,
+        )
+        first_row = (page_num - 1) * page_size
+
+        st.caption(
+            f"Showing rows {first_row + 1} to {min(first_row + page_size, num_rows)} of {num_rows}"
+        )
+
+    st.dataframe(arrow_table.slice(first_row, page_size), **st_dataframe_kwargs)
+
+
+# Fetches the plays newer than the after cursor from the recently played endpoint.
+# The endpoint only keeps the latest plays, so this should be called often enough to not miss any.
+# Returns a DataFrame with one row per play and artist, and the new after cursor (Unix ms).
+# Args:
+# access_token: the access token needed to call the Spotify API
+# after_cursor: only plays after this time (Unix ms) are fetched. If None, the latest plays are fetched.
+def spotify_get_recently_played_since(access_token, after_cursor):
+    plays_list = []
+
+    # Move the cursor forward until a call returns less than a full page of plays
+    while True:
+        recently_played_query = {"limit": max_recently_played_per_call}
+        if after_cursor is not None:
+            recently_played_query["after"] = after_cursor
+
+        recently_played = spotify_get_all_results(
+            access_token,
+            f"{spotify_api_endpoint}me/player/recently-played",
+            "application/json",
+            query=recently_played_query,
+            max_parse_level=1,
+            base_obj="items",
+            paginated=False,
+        )
+
+        if recently_played.empty:
+            break
+
+        recently_played[played_at_str] = pd.to_datetime(
+            recently_played[played_at_str], utc=True
+        )
+        plays_list.append(recently_played)
+
+        after_cursor = int(recently_played[played_at_str].max().timestamp() * 1000)
+
+        if len(recently_played) < max_recently_played_per_call:
+            break
+
+    if len(plays_list) == 0:
+        return (
+            pd.DataFrame(
+                columns=[played_at_str, track_id_str, artist_id_str, artist_name_str]
+            ),
+            after_cursor,
+        )
+
+    # One row per artist of each play
+    plays = (
+        pd.concat(plays_list)[
+            [played_at_str, f"{track_str}.{id_str}", f"{track_str}.{artists_str}"]
+        ]
+        .set_axis([played_at_str, track_id_str, artists_str], axis=1)
+        .explode(artists_str)
+    )
+    plays[artist_id_str] = plays[artists_str].str.get(id_str)
+    plays[artist_name_str] = plays[artists_str].str.get(name_str)
+
+    return (
+        plays.drop(artists_str, axis=1)
+        .drop_duplicates([played_at_str, artist_id_str])
+        .reset_index(drop=True),
+        after_cursor,
+    )
+
+
+# Writes an Arrow table to a Parquet file atomically, so readers never see a partially written file.
+# Args:
+# arrow_table: the pyarrow Table to write
+# path: the path of the Parquet file
+def write_parquet_atomically(arrow_table, path):
+    temp_path = f"{path}.tmp"
+    pq.write_table(arrow_table, temp_path)
+    os.replace(temp_path, path)
+
+
+# Reads a user's running play counts per artist.
+# Returns a DataFrame with id, name and play_count columns, and the after cursor (Unix ms) it is up to date with.
+# The cursor is None if the user's play log has never been synced.
+# Args:
+# user_play_log_dir: the directory of the user's play log
+def read_artist_play_counts(user_play_log_dir):
+    path = os.path.join(user_play_log_dir, artist_play_counts_file_name)
+
+    if not os.path.exists(path):
+        return pd.DataFrame(columns=[id_str, name_str, play_count_str]), None
+
+    artist_play_counts_table = pq.read_table(path)
+
+    return (
+        artist_play_counts_table.to_pandas(),
+        int(artist_play_counts_table.schema.metadata[play_log_cursor_key]),
+    )
+
+
+# Returns the Arrow schema of play log part files.
+# Every part is written with it, rather than the types inferred from its plays, so parts can always be concatenated.
+# E.g. a sync of only local file plays would otherwise have null typed id columns.
+def get_play_log_schema():
+    return pa.schema(
+        [
+            (played_at_str, pa.timestamp("ms", tz="UTC")),
+            (track_id_str, pa.string()),
+            (artist_id_str, pa.string()),
+            (artist_name_str, pa.string()),
+        ]
+    )
+
+
+# Appends plays to a user's play log as a new part file.
+# The part file is named after the cursor the plays were fetched after, so a retried sync overwrites it instead of duplicating plays.
+# Args:
+# user_play_log_dir: the directory of the user's play log
+# plays: DataFrame of plays, as returned by spotify_get_recently_played_since
+# after_cursor: the cursor (Unix ms) the plays were fetched after, or None for the first sync
+def append_to_play_log(user_play_log_dir, plays, after_cursor):
+    write_parquet_atomically(
+        pa.Table.from_pandas(plays, schema=get_play_log_schema(), preserve_index=False),
+        os.path.join(
+            user_play_log_dir,
+            f"{play_log_part_prefix}{after_cursor or 0:013d}.parquet",
+        ),
+    )
+
+
+# Compacts a user's play log part files into one when there are more than max_play_log_parts of them.
+# Only call once the running play counts are written, so a retried sync can't append plays already compacted away.
+# Plays are deduplicated while compacting, so compaction interrupted before removing the old parts is repaired by the next one.
+# Args:
+# user_play_log_dir: the directory of the user's play log
+def compact_play_log(user_play_log_dir):
+    # Zero padding the cursors keeps the part files in order by name
+    part_file_names = sorted(
+        x
+        for x in os.listdir(user_play_log_dir)
+        if x.startswith(play_log_part_prefix) and x.endswith(".parquet")
+    )
+
+    if len(part_file_names) > max_play_log_parts:
+        part_paths = [os.path.join(user_play_log_dir, x) for x in part_file_names]
+
+        # Replace the first part file with all of the parts, then remove the rest.
+        # Parts are cast to the play log schema, since parts written before it was fixed may have inferred types.
+        play_log_schema = get_play_log_schema()
+        plays = (
+            pa.concat_tables(
+                [pq.read_table(x).cast(play_log_schema) for x in part_paths]
+            )
+            .to_pandas()
+            .drop_duplicates([played_at_str, artist_id_str])
+        )
+        write_parquet_atomically(
+            pa.Table.from_pandas(plays, schema=play_log_schema, preserve_index=False),
+            part_paths[0],
+        )
+        for part_path in part_paths[1:]:
+            os.remove(part_path)
+
+
+# Syncs a user's play log with their plays since the last sync, and updates their running play counts per artist.
+# Only the new plays are fetched and counted, so the log never needs to be read back in full.
+# Returns the user's up to date play counts per artist.
+# Args:
+# access_token: the access token needed to call the Spotify API
+# user_id: the Spotify user id whose play log to sync
+# play_log_locks: the PlayLogLocks to take the user's lock from. It is held while syncing, so concurrent sessions of a user don't interleave their appends.
+def sync_play_log(access_token, user_id, play_log_locks):
+    user_play_log_dir = os.path.join(play_log_dir, urllib.parse.quote(user_id, safe=""))
+    os.makedirs(user_play_log_dir, exist_ok=True)
+
+    with play_log_locks.get(user_id):
+        artist_play_counts, after_cursor = read_artist_play_counts(user_play_log_dir)
+
+        plays, new_after_cursor = spotify_get_recently_played_since(
+            access_token, after_cursor
+        )
+
+        if plays.empty:
+            return artist_play_counts
+
+        append_to_play_log(user_play_log_dir, plays, after_cursor)
+
+        # Add the new plays to the running counts
+        artist_play_counts = (
+            pd.concat(
+                [
+                    artist_play_counts,
+                    plays.groupby([artist_id_str, artist_name_str])
+                    .size()
+                    .rename_axis([id_str, name_str])
+                    .reset_index(name=play_count_str),
+                ]
+            )
+            .groupby(id_str, as_index=False)
+            .agg({name_str: "last", play_count_str: "sum"})
+            .astype({play_count_str: int})
+            .sort_values(play_count_str, ascending=False)
+            .reset_index(drop=True)
+        )
+
+        # The cursor is stored with the counts, so both are updated in one atomic write
+        artist_play_counts_table = pa.Table.from_pandas(
+            artist_play_counts, preserve_index=False
+        )
+        write_parquet_atomically(
+            artist_play_counts_table.replace_schema_metadata(
+                artist_play_counts_table.schema.metadata
+                | {play_log_cursor_key: str(new_after_cursor).encode()}
+            ),
+            os.path.join(user_play_log_dir, artist_play_counts_file_name),
+        )
+
+        compact_play_log(user_play_log_dir)
+
+    return artist_play_counts
+
+
+# Runs the app's aggregations and joins on the data fetched from Spotify with pandas. The default query backend.
+class PandasQueryBackend:
+    # Returns the number of liked tracks per artist. See compute_num_tracks_per_artist.
+    def compute_num_tracks_per_artist(self, my_tracks):
+        return compute_num_tracks_per_artist(my_tracks)
+
+    # Returns top tracks with their artists' names. See compute_top_tracks_with_artists.
+    def compute_top_tracks_with_artists(self, my_top_tracks):
+        return compute_top_tracks_with_artists(my_top_tracks)
+
+    # Returns the outer join of liked and followed artists. See merge_liked_and_followed_artists.
+    def merge_liked_and_followed_artists(
+        self, my_liked_artists_imgs, my_followed_artists_imgs
+    ):
+        return merge_liked_and_followed_artists(
+            my_liked_artists_imgs, my_followed_artists_imgs
+        )
+
+
+# Runs the app's aggregations and joins as SQL queries in an embedded DuckDB database.
+# The normalized pages are registered with DuckDB as Arrow tables and queried with multi-threaded execution.
+# Only the final results are materialized, rather than every intermediate DataFrame.
+# Returns the same results as PandasQueryBackend.
+# Args:
+# database: path of the DuckDB database file, or ":memory:" for an in-memory database.
+#   A file lets DuckDB spill to disk when a query does not fit in memory.
+class DuckDBQueryBackend:
+    def __init__(self, database):
+        import duckdb
+
+        self.connection = duckdb.connect(database)
+
+    # Runs a query on DataFrames, each registered as a table under its keyword argument's name.
+    # Each query gets its own cursor, so queries from the background fetch job and the script thread don't interfere.
+    # Returns the result as a DataFrame.
+    # Args:
+    # sql: the query to run
+    # tables: the DataFrames the query reads, keyed by table name
+    def query(self, sql, **tables):
+        cursor = self.connection.cursor()
+
+        try:
+            for table_name, df in tables.items():
+                cursor.register(
+                    table_name, pa.Table.from_pandas(df, preserve_index=False)
+                )
+
+            return cursor.sql(sql).to_arrow_table().to_pandas()
+        finally:
+            cursor.close()
+
+    # Returns the number of liked tracks per artist. See compute_num_tracks_per_artist.
+    def compute_num_tracks_per_artist(self, my_tracks):
+        track_id_col = f"{track_str}.{id_str}"
+        track_artists_col = f"{track_str}.{artists_str}"
+
+        # Unroll artist data, pulling in the added_at field for each track as its UTC date.
+        # Then count the tracks liked per artist. Like pandas' groupby, skip artists without an id or name (e.g. of local files).
+        return self.query(
+            f"""
+            WITH track_artists AS (
+                SELECT
+                    "{track_id_col}" AS {track_id_str},
+                    CAST(CAST({added_at_str} AS TIMESTAMPTZ) AT TIME ZONE 'UTC' AS DATE) AS {added_at_ymd_str},
+                    UNNEST("{track_artists_col}") AS artist
+                FROM my_tracks
+            )
+            SELECT
+                artist.{id_str} AS {id_str},
+                artist.{name_str} AS {name_str},
+                COUNT({track_id_str}) AS {count_track_id_str},
+                MAX({added_at_ymd_str}) AS {max_added_at_ymd_str}
+            FROM track_artists
+            WHERE artist.{id_str} IS NOT NULL AND artist.{name_str} IS NOT NULL
+            GROUP BY 1, 2
+            ORDER BY {count_track_id_str} DESC, {id_str}
+            """,
+            my_tracks=my_tracks[[added_at_str, track_id_col, track_artists_col]],
+        )
+
+    # Returns top tracks with their artists' names. See compute_top_tracks_with_artists.
+    def compute_top_tracks_with_artists(self, my_top_tracks):
+        # Artist names are joined in the order the API lists them
+        return self.query(
+            f"""
+            WITH top_track_artists AS (
+                SELECT
+                    {track_id_str},
+                    {track_rank_str},
+                    {track_name_str},
+                    UNNEST({artists_str}) AS artist,
+                    GENERATE_SUBSCRIPTS({artists_str}, 1) AS artist_index
+                FROM my_top_tracks
+            )
+            SELECT
+                {track_rank_str},
+                {track_id_str},
+                STRING_AGG(artist.{name_str}, '; ' ORDER BY artist_index) AS {artist_name_str},
+                {track_name_str}
+            FROM top_track_artists
+            GROUP BY {track_id_str}, {track_rank_str}, {track_name_str}
+            ORDER BY {track_rank_str}
+            """,
+            my_top_tracks=my_top_tracks[
+                [track_id_str, track_rank_str, track_name_str, artists_str]
+            ],
+        )
+
+    # Returns the outer join of liked and followed artists. See merge_liked_and_followed_artists.
+    def merge_liked_and_followed_artists(
+        self, my_liked_artists_imgs, my_followed_artists_imgs
+    ):
+        # Followed artists with no liked tracks take their name and image URL from the followed artist data.
+        # Every other column comes from the liked artist data.
+        select_cols = ", ".join(
+            (
+                f"COALESCE(liked.{x}, followed.{x}) AS {x}"
+                if x in [id_str, name_str, url_str]
+                else f"liked.{x}"
+            )
+            for x in my_liked_artists_imgs.columns
+        )
+
+        return self.query(
+            f"""
+            SELECT
+                {select_cols},
+                CASE
+                    WHEN followed.{id_str} IS NULL THEN 'left_only'
+                    WHEN liked.{id_str} IS NULL THEN 'right_only'
+                    ELSE 'both'
+                END AS {merge_str}
+            FROM liked
+            FULL OUTER JOIN followed ON liked.{id_str} = followed.{id_str}
+            ORDER BY {id_str}
+            """,
+            liked=my_liked_artists_imgs,
+            followed=my_followed_artists_imgs[[id_str, name_str, url_str]],
+        )
+
+
+# Returns the query backend chosen with the query_backend secret: "pandas" (the default) or "duckdb".
+# The DuckDB database is set with the query_backend_database secret, and is in-memory by default.
+# Shared by all sessions of this app.
+@st.cache_resource
+def get_query_backend():
+    if st.secrets.get("query_backend", pandas_str) == duckdb_str:
+        return DuckDBQueryBackend(st.secrets.get("query_backend_database", ":memory:"))
+
+    return PandasQueryBackend()
+
+
+# A per-session background job that fetches all the Spotify data the dashboard needs, outside the script thread.
+# Streamlit stops the script thread on every rerun, but this job keeps running.
+# A rerun reattaches to it through st.session_state instead of restarting all of the API calls.
+# Results are available per stage as soon as each stage finishes, so the UI can render partial results.
+# Args:
+# access_token: the access token needed to call the Spotify API
+# playlist_snapshot_cache: the PlaylistSnapshotCache used to skip unchanged playlists
+# play_log_locks: the PlayLogLocks shared by all sessions, one lock per user held while syncing their play log
+# query_backend: the PandasQueryBackend or DuckDBQueryBackend to run aggregations and joins with
+class SpotifyFetchJob:
+    def __init__(
+        self, access_token, playlist_snapshot_cache, play_log_locks, query_backend
+    ):
+        self.access_token = access_token
+        self.playlist_snapshot_cache = playlist_snapshot_cache
+        self.play_log_locks = play_log_locks
+        self.query_backend = query_backend
+
+        # Stage name -> result DataFrame, filled in as stages finish
+        self.results = {}
+
+        # Stage name -> (pages loaded, total pages), for stages in progress
+        self.progress = {}
+
+        # The exception that stopped the job, if any
+        self.error = None
+
+        # The exception that stopped the play log sync, if any. It only affects the play counts section.
+        self.play_log_error = None
+
+        # The number of playlists whose items couldn't be fetched, and are left out of the playlist section
+        self.num_skipped_playlists = 0
+
+        self.balloons_shown = False
+
+        self.thread = threading.Thread(target=self.run, daemon=True)
+
+    # Starts the job on its own thread.
+    def start(self):
+        self.thread.start()
+
+    # Runs each stage in order, storing its result under the stage name.
+    # Stops at the first error, which is re-raised in the script thread by wait_for.
+    def run(self):
+        stages = (
+            [(num_tracks_per_artist_str, self.fetch_num_tracks_per_artist)]
+            + [
+                (stage_str, functools.partial(self.fetch_top_tracks, term_timeframe))
+                for stage_str, term_timeframe in zip(
+                    top_tracks_stage_strs, term_timeframes
+                )
+            ]
+            + [
+                (liked_artists_str, self.fetch_liked_artists),
+                (followed_artists_str, self.fetch_followed_artists),
+                (user_profile_str, self.fetch_user_profile),
+                (playlist_tracks_str, self.fetch_playlist_tracks),
+                (artist_play_counts_str, self.fetch_artist_play_counts),
+            ]
+        )
+
+        try:
+            # The data stack may still be importing in the background
+            import_requests()
+            wait_for_data_stack()
+
+            for stage_str, stage_function in stages:
+                self.results[stage_str] = stage_function(
+                    functools.partial(self.set_progress, stage_str)
+                )
+        except Exception as e:
+            self.error = e
+
+    # Records the progress of a stage. Passed to spotify_get_all_results as its progress_callback.
+    def set_progress(self, stage_str, curr_page_num, num_pages):
+        self.progress[stage_str] = (curr_page_num, num_pages)
+
+    # Fetches liked tracks and aggregates them per artist. Also stores the liked track ids.
+    def fetch_num_tracks_per_artist(self, progress_callback):
+        my_tracks = spotify_get_all_results(
+            self.access_token,
+            f"{spotify_api_endpoint}me/tracks",
+            "application/x-www-form-urlencoded",
+            max_parse_level=1,
+            progress_callback=progress_callback,
+        )
+
+        # Local files have no track id
+        self.results[liked_track_ids_str] = my_tracks[f"{track_str}.{id_str}"].dropna()
+
+        return self.query_backend.compute_num_tracks_per_artist(my_tracks)
+
+    # Fetches top tracks for a short/medium/long term time range.
+    def fetch_top_tracks(self, term_timeframe, progress_callback):
+        return spotify_get_all_results(
+            self.access_token,
+            f"{spotify_api_endpoint}me/top/tracks",
+            "application/json",
+            query={"time_range": term_timeframe},
+            progress_callback=progress_callback,
+        )
+
+    # Fetches artist data, including images, for every artist with a liked track.
+    def fetch_liked_artists(self, progress_callback):
+        # Get unique artists whose tracks are liked
+        artist_ids_to_query = self.results[num_tracks_per_artist_str][
+            id_str
+        ].drop_duplicates()
+        max_artists_per_section = 50
+
+        # Convert the pandas Series to a list. The endpoint can only handle 50 artists at a time.
+        # Calculate the number of pages and split. Formula: ceiling(number of rows divided by the page limit).
+        # Collapse each list of strings by a comma.
+        artist_ids_to_query_list = [
+            ",".join(x)
+            for x in np.array_split(
+                list(artist_ids_to_query),
+                np.ceil(len(artist_ids_to_query) / max_artists_per_section),
+            )
+        ]
+
+        # Call the API for all artists in the list
+        my_artists_list = []
+        for artist_id_query_string in artist_ids_to_query_list:
+            progress_callback(len(my_artists_list), len(artist_ids_to_query_list))
+
+            my_artists_list.append(
+                spotify_get_all_results(
+                    self.access_token,
+                    f"{spotify_api_endpoint}artists",
+                    "application/json",
+                    query={"ids": artist_id_query_string},
+                    base_obj="artists",
+                    paginated=False,
+                )
+            )
+
+        return pd.concat(my_artists_list).reset_index(drop=True)
+
+    # Fetches the artists the user follows.
+    def fetch_followed_artists(self, progress_callback):
+        return spotify_get_all_results(
+            self.access_token,
+            f"{spotify_api_endpoint}me/following",
+            "application/json",
+            query={"type": "artist"},
+            base_obj="artists",
+            progress_callback=progress_callback,
+        )
+
+    # Fetches the user's profile, as a single row.
+    def fetch_user_profile(self, progress_callback):
+        return spotify_get_all_results(
+            self.access_token,
+            f"{spotify_api_endpoint}me",
+            "application/json",
+            paginated=False,
+        )
+
+    # Syncs the user's play log with their recently played tracks and returns their play counts per artist.
+    # The play log is stored on local disk, which may be read-only or full. Errors are kept in play_log_error
+    # and None is returned, so they don't stop the job.
+    def fetch_artist_play_counts(self, progress_callback):
+        try:
+            return sync_play_log(
+                self.access_token,
+                self.results[user_profile_str][id_str].item(),
+                self.play_log_locks,
+            )
+        except Exception as e:
+            self.play_log_error = e
+            return None
+
+    # Fetches the items of all of the user's playlists, a bounded number of playlists at a time.
+    # Playlists whose snapshot id is unchanged since they were last fetched are served from the snapshot cache.
+    # Returns one row per playlist item, flagging items in playlists the user owns.
+    # Playlists whose items can't be fetched are skipped and counted in num_skipped_playlists.
+    def fetch_playlist_tracks(self, progress_callback):
+        user_id = self.results[user_profile_str][id_str].item()
+
+        my_playlists = spotify_get_all_results(
+            self.access_token,
+            f"{spotify_api_endpoint}me/playlists",
+            "application/json",
+            query={"limit": 50},
+            max_parse_level=1,
+            progress_callback=progress_callback,
+        )
+
+        # Fetch the playlists concurrently, collecting them in order
+        playlist_tracks_list = []
+        num_fetched_playlists = 0
+        with concurrent.futures.ThreadPoolExecutor(
+            max_workers=max_concurrent_playlist_fetches
+        ) as executor:
+            for playlist_tracks in executor.map(
+                functools.partial(self.fetch_one_playlist_tracks, user_id),
+                my_playlists.get(id_str, []),
+                my_playlists.get(snapshot_id_str, []),
+            ):
+                if playlist_tracks is None:
+                    self.num_skipped_playlists += 1
+                else:
+                    playlist_tracks_list.append(playlist_tracks)
+
+                num_fetched_playlists += 1
+                progress_callback(num_fetched_playlists, len(my_playlists))
+
+        if len(playlist_tracks_list) == 0:
+            return pd.DataFrame(
+                {
+                    playlist_id_str: pd.Series(dtype=object),
+                    track_id_str: pd.Series(dtype=object),
+                    artists_str: pd.Series(dtype=object),
+                    is_own_playlist_str: pd.Series(dtype=bool),
+                }
+            )
+
+        playlist_tracks = pd.concat(playlist_tracks_list).reset_index(drop=True)
+
+        playlist_tracks[is_own_playlist_str] = playlist_tracks[playlist_id_str].isin(
+            my_playlists.loc[my_playlists[owner_id_str] == user_id, id_str]
+        )
+
+        return playlist_tracks
+
+    # Fetches the items of one playlist, unless its snapshot id shows it is unchanged since it was cached.
+    # Returns one row per playlist item with a track id, or None if the items can't be fetched.
+    # E.g. Spotify returns 404 for the items of its own editorial and algorithmic playlists to newer apps.
+    def fetch_one_playlist_tracks(self, user_id, playlist_id, snapshot_id):
+        cache_key = (user_id, playlist_id)
+
+        cached_snapshot = self.playlist_snapshot_cache.get(cache_key)
+        if cached_snapshot is not None and cached_snapshot[0] == snapshot_id:
+            return cached_snapshot[1]
+
+        # Per-playlist progress is not shown, only the number of playlists fetched
+        try:
+            playlist_tracks = spotify_get_all_results(
+                self.access_token,
+                f"{spotify_api_endpoint}playlists/{playlist_id}/tracks",
+                "application/json",
+                query={"fields": playlist_items_fields, "limit": 100},
+                max_parse_level=1,
+                progress_callback=lambda curr_page_num, num_pages: None,
+            )
+        except requests.RequestException:
+            return None
+
+        # Empty playlists come back without any columns, so reindex instead of selecting.
+        # Reindexing adds the missing columns as float NaN, so cast them back to object like the JSON columns.
+        # Items without a track id (e.g. removed or local tracks) are dropped.
+        playlist_tracks = (
+            playlist_tracks.reindex(
+                columns=[f"{track_str}.{id_str}", f"{track_str}.{artists_str}"]
+            )
+            .set_axis([track_id_str, artists_str], axis=1)
+            .astype(object)
+            .dropna(subset=track_id_str)
+        )
+        playlist_tracks.insert(0, playlist_id_str, playlist_id)
+
+        self.playlist_snapshot_cache.put(cache_key, snapshot_id, playlist_tracks)
+
+        return playlist_tracks
+
+    # Called from the script thread. Blocks until a stage finishes, showing its progress, and returns its result.
+    # Args:
+    # stage_str: the name of the stage to wait for
+    def wait_for(self, stage_str):
+        progress_bar = None
+
+        while stage_str not in self.results:
+            # Crash on error, like the API calls would in the script thread
+            if self.error is not None:
+                raise self.error
+
+            if progress_bar is None:
+                progress_bar = st.progress(0, text="Loading...")
+
+            curr_page_num, num_pages = self.progress.get(stage_str, (0, None))
+            if num_pages:
+                progress_bar.progress(
+                    curr_page_num / num_pages,
+                    text=f"Loaded Page: {curr_page_num} of {num_pages}",
+                )
+
+            time.sleep(fetch_job_poll_interval_s)
+
+        # When the stage is complete, stop showing the progress bar
+        if progress_bar is not None:
+            progress_bar.empty()
+
+        return self.results[stage_str]
+
+
+# A least recently used cache of playlist items by snapshot id, bounded by the total number of playlist items it holds.
+# Entries are keyed by (user id, playlist id) and hold (snapshot id, playlist tracks).
+# Safe to use from the threads fetching playlists concurrently.
+# Args:
+# max_items: the number of playlist items to hold at most. Playlists with more items than this are not cached.
+class PlaylistSnapshotCache:
+    def __init__(self, max_items):
+        self.max_items = max_items
+        self.entries = collections.OrderedDict()
+        self.num_items = 0
+        self.lock = threading.Lock()
+
+    # Returns the (snapshot id, playlist tracks) cached for a key, or None, marking it as recently used.
+    # Args:
+    # cache_key: the (user id, playlist id) to look up
+    def get(self, cache_key):
+        with self.lock:
+            cached_snapshot = self.entries.get(cache_key)
+            if cached_snapshot is not None:
+                self.entries.move_to_end(cache_key)
+
+            return cached_snapshot
+
+    # Caches the items of a playlist snapshot, evicting the least recently used playlists until they fit.
+    # Args:
+    # cache_key: the (user id, playlist id) to cache under
+    # snapshot_id: the snapshot id of the playlist
+    # playlist_tracks: DataFrame of the playlist's items
+    def put(self, cache_key, snapshot_id, playlist_tracks):
+        with self.lock:
+            replaced_snapshot = self.entries.pop(cache_key, None)
+            if replaced_snapshot is not None:
+                self.num_items -= len(replaced_snapshot[1])
+
+            if len(playlist_tracks) > self.max_items:
+                return
+
+            self.entries[cache_key] = (snapshot_id, playlist_tracks)
+            self.num_items += len(playlist_tracks)
+
+            while self.num_items > self.max_items:
+                _, evicted_snapshot = self.entries.popitem(last=False)
+                self.num_items -= len(evicted_snapshot[1])
+
+
+# Returns the cache of playlist items by snapshot id, shared by all sessions of this app.
+# Entries are keyed by user id as well as playlist id, so a user only ever reads their own entries.
+@st.cache_resource
+def get_playlist_snapshot_cache():
+    return PlaylistSnapshotCache(max_playlist_snapshot_cache_items)
+
+
+# One lock per user, held while syncing that user's play log.
+# Syncs of different users don't wait on each other, since the lock is held across the recently played API calls.
+class PlayLogLocks:
+    def __init__(self):
+        self.locks = {}
+        self.lock = threading.Lock()
+
+    # Returns the lock of a user, creating it on first use.
+    # Args:
+    # user_id: the Spotify user id whose play log is synced
+    def get(self, user_id):
+        with self.lock:
+            return self.locks.setdefault(user_id, threading.Lock())
+
+
+# Returns the per-user play log locks, shared by all sessions of this app.
+@st.cache_resource
+def get_play_log_locks():
+    return PlayLogLocks()
+
+
+# Returns this session's background fetch job, starting a new one if there is none for this access token.
+# A job that stopped on an error is replaced, so a rerun retries.
+# Args:
+# access_token: the access token needed to call the Spotify API
+def get_or_start_fetch_job(access_token):
+    fetch_job = st.session_state.get(fetch_job_str)
+
+    if (
+        fetch_job is None
+        or fetch_job.access_token != access_token
+        or fetch_job.error is not None
+    ):
+        fetch_job = SpotifyFetchJob(
+            access_token,
+            get_playlist_snapshot_cache(),
+            get_play_log_locks(),
+            get_query_backend(),
+        )
+        fetch_job.start()
+        st.session_state[fetch_job_str] = fetch_job
+
+    return fetch_job
+
+
 # Where the real magic starts. Retrieves an access token and runs the rest of the app.
 # Args:
 # initial_oauth_token: the OAuth 2.0 token
@@ -352,6 +1503,10 @@ def generate_style_and_div_blocks(
 # client_secret: Spotify client secret
 # redirect_uri: OAuth 2.0 redirect uri
 def run_app(initial_oauth_token, client_id, client_secret, redirect_uri):
+    # Start loading the data stack while the access token is retrieved
+    start_data_stack_import()
+    import_requests()
+
     # Set up for the API call to retrieve an access token
     base64_encoding = "ascii"
 
@@ -382,61 +1537,36 @@ def run_app(initial_oauth_token, client_id, client_secret, redirect_uri):
     get_bearer_token_response.raise_for_status()
 
     # Read the resulting JSON and retrieve your access token!
+    # Keep it in the session so reruns (e.g. from widgets) don't send the user back to the Welcome screen.
     get_bearer_token_response_json = get_bearer_token_response.json()
-    run_app_contents(get_bearer_token_response_json["access_token"])
+    st.session_state[access_token_str] = get_bearer_token_response_json[
+        access_token_str
+    ]
+    # Start loading the data right away, in the background
+    get_or_start_fetch_job(st.session_state[access_token_str])
+    run_app_contents(st.session_state[access_token_str])
 
 
 # Pulls all the Spotify data and populates the Streamlit app
 # Args:
 # access_token: the access token needed to call the Spotify API
 def run_app_contents(access_token):
-    # API call happens here
-    my_tracks = spotify_get_all_results(
-        access_token,
-        f"{spotify_api_endpoint}me/tracks",
-        "application/x-www-form-urlencoded",
-        max_parse_level=1,
-        balloons=True,
-    )
-
-    # Header and column cleanup
-    my_tracks.columns = my_tracks.columns.str.replace(f"{track_str}.", "", regex=False)
-    my_tracks = my_tracks.rename(columns={id_str: track_id_str})
-
-    my_tracks[added_at_str] = pd.to_datetime(my_tracks[added_at_str])
-
-    # Unroll artist data
-    track_artists_df = convert_json_col_to_dataframe_with_key(
-        my_tracks, track_id_str, artists_str
-    )
-
-    # Pull in the added_at field for each track
-    track_artists_df_with_added_at = pd.merge(
-        track_artists_df, my_tracks[[track_id_str, added_at_str]], on=track_id_str
-    )
-
-    # Create field for added_at formatted as YYYY-MM-DD
-    track_artists_df_with_added_at[added_at_ymd_str] = track_artists_df_with_added_at[
-        added_at_str
-    ].dt.date
+    import_requests()
+    wait_for_data_stack()
 
-    # Use the DataFrame linking tracks to artists to get the number of tracks liked per artist.
-    num_tracks_per_artist = (
-        track_artists_df_with_added_at.groupby([id_str, name_str])
-        .agg({track_id_str: "count", added_at_ymd_str: "max"})
-        .sort_values(track_id_str, ascending=False)
-        .reset_index()
-        .rename(
-            columns={
-                track_id_str: count_track_id_str,
-                added_at_ymd_str: max_added_at_ymd_str,
-            }
-        )
-    )
+    # Reattach to this session's background fetch job, if one is running
+    fetch_job = get_or_start_fetch_job(access_token)
 
     # Create the logout button
     st.link_button("Logout", "https://spotify.com/logout", type="primary")
 
+    num_tracks_per_artist = fetch_job.wait_for(num_tracks_per_artist_str)
+
+    # Celebrate the liked tracks loading, but only once per job
+    if not fetch_job.balloons_shown:
+        fetch_job.balloons_shown = True
+        st.balloons()
+
     # Some plotly code that did not make the cut because it made the UX of mobile scrolling worse:
     # my_px_color_theme = px.colors.sequential.Sunset
 
@@ -460,24 +1590,28 @@ def run_app_contents(access_token):
 
     # px_displaybarconfig = {"displayModeBar": False}
 
-    # The top DataFrame to display
+    # The top DataFrame to display.
+    # Convert to Arrow once, selecting and renaming columns on the Arrow table (zero-copy) so Streamlit can serialize it directly.
+    num_tracks_per_artist_table = pa.Table.from_pandas(
+        num_tracks_per_artist,
+        columns=[name_str, count_track_id_str, max_added_at_ymd_str],
+        preserve_index=False,
+    ).rename_columns([artist_str, count_track_id_str, last_liked_date_str])
+
     st.subheader("All Artists and Liked Track Counts")
-    st.dataframe(
-        num_tracks_per_artist[
-            [name_str, count_track_id_str, max_added_at_ymd_str]
-        ].rename(
-            columns={
-                name_str: artist_str,
-                max_added_at_ymd_str: last_liked_date_str,
-            }
-        ),
+    st_paginated_arrow_dataframe(
+        num_tracks_per_artist_table,
+        max_rows_per_table_page,
+        "all_artists_page",
         column_config={
             count_track_id_str: st.column_config.ProgressColumn(
                 num_liked_tracks_str,
                 width=None,
                 min_value=0,
                 format="%d",
-                max_value=num_tracks_per_artist[count_track_id_str].max().item(),
+                max_value=pc.max(
+                    num_tracks_per_artist_table[count_track_id_str]
+                ).as_py(),
             ),
         },
         use_container_width=True,
@@ -489,11 +1623,6 @@ def run_app_contents(access_token):
     # Convert the tuple to a list
     bcols = list(st.columns(3))
 
-    term_str = "term"
-    underscore_term_str = f"_{term_str}"
-    term_timeframes_friendly = ["short", "medium", "long"]
-    term_timeframes = [f"{x}{underscore_term_str}" for x in term_timeframes_friendly]
-
     # For each of short/medium/long term track API calls, populate a Streamlit column with the data visualizations.
     for bcol_index in range(len(bcols)):
         bcol = bcols[bcol_index]
@@ -503,14 +1632,9 @@ def run_app_contents(access_token):
                 f"My {term_timeframes_friendly[bcol_index]}-{term_str} Top Tracks".title()
             )
 
-            # API Call
+            # Data from the background API call
             my_top_tracks = (
-                spotify_get_all_results(
-                    access_token,
-                    f"{spotify_api_endpoint}me/top/tracks",
-                    "application/json",
-                    query={"time_range": term_timeframes[bcol_index]},
-                )
+                fetch_job.wait_for(top_tracks_stage_strs[bcol_index])
                 .rename(columns={id_str: track_id_str, name_str: track_name_str})
                 .head(50)
             )
@@ -532,23 +1656,8 @@ def run_app_contents(access_token):
             my_top_tracks[track_rank_str] = range(1, len(my_top_tracks) + 1)
 
             # Bring in artist information
-            # Tracks can have more than 1 artist, so flatten the artist_name column so each is seperated by a "; ".
-            # We do so to have 1 row per track.
             my_top_tracks_with_artist = (
-                pd.merge(
-                    my_top_tracks[[track_id_str, track_rank_str, track_name_str]],
-                    convert_json_col_to_dataframe_with_key(
-                        my_top_tracks, track_id_str, artists_str
-                    ),
-                    on=track_id_str,
-                )
-                .rename(columns={name_str: artist_name_str})
-                .groupby([track_id_str, track_rank_str, track_name_str])
-                .agg({artist_name_str: "; ".join})
-                .sort_values(track_rank_str, ascending=True)
-                .reset_index()[
-                    [track_rank_str, track_id_str, artist_name_str, track_name_str]
-                ]
+                fetch_job.query_backend.compute_top_tracks_with_artists(my_top_tracks)
             )
 
             # Link back to each 300 px height album image
@@ -581,38 +1690,9 @@ def run_app_contents(access_token):
                     unsafe_allow_html=True,
                 )
 
-    # Get unique artists whose tracks are liked
-    artist_ids_to_query = num_tracks_per_artist[id_str].drop_duplicates()
-    max_artists_per_section = 50
-
-    # Convert the pandas Series to a list. The endpoint can only handle 50 artists at a time.
-    # Calculate the number of pages and split. Formula: ceiling(number of rows divided by the page limit).
-    # Collapse each list of strings by a comma.
-    artist_ids_to_query_list = [
-        ",".join(x)
-        for x in np.array_split(
-            list(artist_ids_to_query),
-            np.ceil(len(artist_ids_to_query) / max_artists_per_section),
-        )
-    ]
-
-    # Call the API for all artists in the list
-    my_artists_list = []
-    for artist_id_query_string in artist_ids_to_query_list:
-        my_artists_list.append(
-            spotify_get_all_results(
-                access_token,
-                f"{spotify_api_endpoint}artists",
-                "application/json",
-                query={"ids": artist_id_query_string},
-                base_obj="artists",
-                paginated=False,
-            )
-        )
-
     # Union the results and bring in liked tracks metadata, also retaining image data
     my_liked_artists = pd.merge(
-        pd.concat(my_artists_list).reset_index(drop=True)[[id_str, images_str]],
+        fetch_job.wait_for(liked_artists_str)[[id_str, images_str]],
         num_tracks_per_artist,
         on=id_str,
         how="inner",
@@ -621,58 +1701,18 @@ def run_app_contents(access_token):
     # Get image URL for each artist appended to the DataFrame
     my_liked_artists_imgs = spotify_unroll_image_helper(my_liked_artists)
 
-    # Call the API for followed artist data
-    my_followed_artists = spotify_get_all_results(
-        access_token,
-        f"{spotify_api_endpoint}me/following",
-        "application/json",
-        query={"type": "artist"},
-        base_obj="artists",
-    )
+    # Followed artist data from the background API call
+    my_followed_artists = fetch_job.wait_for(followed_artists_str)
 
     # Get image URL for each artist appended to the DataFrame
     my_followed_artists_imgs = spotify_unroll_image_helper(my_followed_artists)
 
     # Perform an outer join between liked and followed artists
-    my_left = my_liked_artists_imgs
-    my_right = my_followed_artists_imgs
-
-    my_left_cols = [x for x in my_left.columns]
-
-    merge_str = "_merge"
-    underscore_y_str = "_y"
-    url_y_str = url_str + underscore_y_str
-    name_y_str = name_str + underscore_y_str
-
-    my_followed_and_liked_artists_df = pd.merge(
-        my_left,
-        my_right,
-        on=id_str,
-        how="outer",
-        suffixes=("", underscore_y_str),
-        indicator=True,
-    )[my_left_cols + [name_y_str, url_y_str, merge_str]]
-
-    # Look for rows where an artist is followed with no liked songs.
-    # "name" would be NA but "name_y" would not be.
-    unfollow_artist_rec_rows_to_retrieve = my_followed_and_liked_artists_df[
-        name_str
-    ].isna()
-
-    # Get the name and URL for those rows
-    unfollow_artist_rec_replace_vals = my_followed_and_liked_artists_df.loc[
-        unfollow_artist_rec_rows_to_retrieve, [name_y_str, url_y_str]
-    ]
-
-    # Replace "name" and "url" columns with the retrieved values
-    my_followed_and_liked_artists_df.loc[
-        unfollow_artist_rec_rows_to_retrieve, [name_str, url_str]
-    ] = unfollow_artist_rec_replace_vals.values
-
-    # Remove extraneous columns
-    my_followed_and_liked_artists_df = my_followed_and_liked_artists_df[
-        my_left_cols + [merge_str]
-    ]
+    my_followed_and_liked_artists_df = (
+        fetch_job.query_backend.merge_liked_and_followed_artists(
+            my_liked_artists_imgs, my_followed_artists_imgs
+        )
+    )
 
     # Start to populate follow/unfollow recommendations
     followrecscol, unfollowrecscol = st.columns(2)
@@ -725,6 +1765,106 @@ def run_app_contents(access_token):
         else:
             st.success(no_recs_str)
 
+    # Playlist section
+    st.subheader("My Playlists")
+    playlist_tracks = fetch_job.wait_for(playlist_tracks_str)
+
+    if fetch_job.num_skipped_playlists > 0:
+        st.caption(
+            f"{fetch_job.num_skipped_playlists} playlist(s) couldn't be loaded and are left out."
+        )
+
+    # How liked tracks and playlist tracks overlap, one count per column
+    playlist_track_overlap = compute_playlist_track_overlap(
+        playlist_tracks, fetch_job.results[liked_track_ids_str]
+    )
+    for metric_col, (metric_label, metric_value) in zip(
+        st.columns(len(playlist_track_overlap)), playlist_track_overlap.items()
+    ):
+        with metric_col:
+            st.metric(metric_label, metric_value)
+
+    # The liked artists that show up the most in playlists the user owns
+    liked_artists_in_playlists = compute_liked_artists_in_playlists(
+        playlist_tracks.loc[playlist_tracks[is_own_playlist_str].astype(bool)],
+        num_tracks_per_artist,
+    ).head(num_top_artists)
+
+    st.subheader("Liked Artists Dominating My Playlists")
+    if len(liked_artists_in_playlists) > 0:
+        st.dataframe(
+            liked_artists_in_playlists[
+                [name_str, count_playlist_track_id_str, count_track_id_str]
+            ].rename(
+                columns={
+                    name_str: artist_str,
+                    count_track_id_str: num_liked_tracks_str,
+                }
+            ),
+            column_config={
+                count_playlist_track_id_str: st.column_config.ProgressColumn(
+                    num_playlist_tracks_str,
+                    width=None,
+                    min_value=0,
+                    format="%d",
+                    max_value=liked_artists_in_playlists[count_playlist_track_id_str]
+                    .max()
+                    .item(),
+                ),
+            },
+            use_container_width=True,
+            hide_index=True,
+        )
+    else:
+        st.info("None of your liked artists are in playlists you own yet.")
+
+    # Recently played section
+    st.subheader("My Most Played Artists")
+    st.caption(
+        "Play counts build up from your recently played tracks each time you open your dashboard."
+    )
+
+    artist_play_counts = fetch_job.wait_for(artist_play_counts_str)
+
+    if artist_play_counts is None:
+        st.warning(f"Your play history couldn't be updated: {fetch_job.play_log_error}")
+        return
+
+    # Bring in the number of liked tracks for each played artist
+    artist_play_counts = pd.merge(
+        artist_play_counts,
+        num_tracks_per_artist[[id_str, count_track_id_str]],
+        on=id_str,
+        how="left",
+    ).fillna({count_track_id_str: 0})
+
+    if len(artist_play_counts) > 0:
+        st.dataframe(
+            artist_play_counts.head(num_top_artists)[
+                [name_str, play_count_str, count_track_id_str]
+            ]
+            .astype({count_track_id_str: int})
+            .rename(
+                columns={
+                    name_str: artist_str,
+                    count_track_id_str: num_liked_tracks_str,
+                }
+            ),
+            column_config={
+                play_count_str: st.column_config.ProgressColumn(
+                    num_plays_str,
+                    width=None,
+                    min_value=0,
+                    format="%d",
+                    max_value=artist_play_counts[play_count_str].max().item(),
+                ),
+            },
+            use_container_width=True,
+            hide_index=True,
+        )
+    else:
+        st.info("No recently played tracks yet.")
+
 
 # Generates a simple horizontalled centered div
 # Args:
@@ -754,45 +1894,47 @@ def st_write_centered_text(html_element, text, html_element_attr=None):
     )
 
 
-# Get the query parameters of the URL in the browser
-query_params = st.query_params
+# Renders the Welcome screen, or the dashboard once the user has signed in.
+def main():
+    # Get the query parameters of the URL in the browser
+    query_params = st.query_params
 
-# Variable setup
-code_str = "code"
-scopes = "user-read-private user-read-email playlist-read-private user-follow-read user-top-read user-read-recently-played user-library-read"
-client_id_str = "client_id"
-client_secret_str = "client_secret"
-redirect_uri_str = "redirect_uri"
-
-# Read from local secrets (when locally run) file or app secrets (when running deployed version).
-client_id = st.secrets[client_id_str]
-client_secret = st.secrets[client_secret_str]
-redirect_uri = st.secrets[redirect_uri_str]
-
-# If there is no OAuth 2.0 code in the query parameters, generate the Welcome screen.
-if code_str not in query_params:
-    oath_token_url = f"{spotify_accounts_endpoint}authorize?client_id={client_id}&response_type=code&redirect_uri={redirect_uri}&scope={scopes}"
-
-    st_write_centered_text("h2", "Welcome to Your Spotify Dashboard 👋")
-
-    st_write_centered_text(
-        "p",
-        """
+    # Variable setup
+    code_str = "code"
+    scopes = "user-read-private user-read-email playlist-read-private user-follow-read user-top-read user-read-recently-played user-library-read"
+    client_id_str = "client_id"
+    client_secret_str = "client_secret"
+    redirect_uri_str = "redirect_uri"
+
+    # Read from local secrets (when locally run) file or app secrets (when running deployed version).
+    client_id = st.secrets[client_id_str]
+    client_secret = st.secrets[client_secret_str]
+    redirect_uri = st.secrets[redirect_uri_str]
+
+    # If there is no OAuth 2.0 code in the query parameters and no session yet, generate the Welcome screen.
+    if code_str not in query_params and access_token_str not in st.session_state:
+        oath_token_url = f"{spotify_accounts_endpoint}authorize?client_id={client_id}&response_type=code&redirect_uri={redirect_uri}&scope={scopes}"
+
+        st_write_centered_text("h2", "Welcome to Your Spotify Dashboard 👋")
+
+        st_write_centered_text(
+            "p",
+            """
 This Streamlit app works directly and exclusively with the Spotify API to surface some insights on your music preferences.
 
 Now, let's get you signed in. Clicking the link at the bottom of this page will initiate the sign-in process. So, if you are logged into Spotify already in your browser, you won't need to enter your password again! Just click the link. If not, have no fear. You will be redirected to Spotify's login page and then brought back here.
 
 **One last note:** once you are in your dashboard, be sure to click the "logout" button when you are done. Refresh this page and your data will disappear from your session. You will remain logged in to the Spotify web app in your browser unless you explicitly log out.""",
-    )
+        )
 
-    st_write_centered_text("h5", "Are you ready to see your data?")
+        st_write_centered_text("h5", "Are you ready to see your data?")
 
-    rounded_button_class_raw = "rounded-button"
-    rounded_button_class = f".{rounded_button_class_raw}"
+        rounded_button_class_raw = "rounded-button"
+        rounded_button_class = f".{rounded_button_class_raw}"
 
-    # Set some CSS and HTML to center the elements (not supported in Streamlit natively)
-    st.markdown(
-        f"""
+        # Set some CSS and HTML to center the elements (not supported in Streamlit natively)
+        st.markdown(
+            f"""
 <style>
     /* Styling for the button */
     {rounded_button_class} {{
@@ -822,18 +1964,29 @@ Now, let's get you signed in. Clicking the link at the bottom of this page will
 </style>
 {generate_centered_div("a", "Let's go!", f'href="{oath_token_url}" class="{rounded_button_class_raw}"')}
 """,
-        unsafe_allow_html=True,
-    )
-# If there is an OAuth 2.0 code in the query parameters, run the analysis.
-else:
-    # Grab your token
-    oauth_initial_token = query_params[code_str]
+            unsafe_allow_html=True,
+        )
+    # If there is an OAuth 2.0 code in the query parameters, run the analysis.
+    elif code_str in query_params:
+        # Grab your token
+        oauth_initial_token = query_params[code_str]
+
+        # Removes the query parameters from the browser URL and does not rerun the page
+        st.query_params.clear()
+
+        # Set the default layout for the frontend
+        st.set_page_config(layout="wide")
+
+        # Run the analysis.
+        run_app(oauth_initial_token, client_id, client_secret, redirect_uri)
+    # On a rerun of an existing session, run the analysis with the access token already retrieved.
+    else:
+        # Set the default layout for the frontend
+        st.set_page_config(layout="wide")
 
-    # Removes the query parameters from the browser URL and does not rerun the page
-    st.query_params.clear()
+        run_app_contents(st.session_state[access_token_str])
 
-    # Set the default layout for the frontend
-    st.set_page_config(layout="wide")
 
-    # Run the analysis.
-    run_app(oauth_initial_token, client_id, client_secret, redirect_uri)
+# Streamlit runs this file as __main__. Importing it (e.g. for benchmarks) has no side effects.
+if __name__ == "__main__":
+    main()